@@ -3,20 +3,35 @@
 from __future__ import unicode_literals
 import argparse
 from flask import Flask, request, redirect, url_for, render_template
-from transcribe_audio_deepgram import extract_text_from_audio  # Import function for audio transcription
-from speaker_analysis_gpt import analyse_conversation  # Import function for speaker analysis
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import FileTarget, ValueTarget
+from werkzeug.utils import secure_filename
 import json
 import os
-import magic
+import uuid
 
 app = Flask(__name__)
 
+# Target folder for the uploads, shared with the background workers.
+UPLOAD_FOLDER = os.path.join(app.static_folder, "uploads")
 
-# Function to check if the file is an audio file based on MIME type
-def is_audio(file_path):
-    mime = magic.Magic(mime=True)
-    file_mime_type = mime.from_file(file_path)
-    return file_mime_type.startswith('audio/')
+# Size of the chunks read from the request body while streaming an upload to disk.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class SingleFileTarget(FileTarget):
+    """FileTarget rejecting the extra parts when several files are sent under the same field."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.parts = 0
+
+    def on_start(self):
+        # A second part would reopen the target file and overwrite the first one.
+        self.parts += 1
+        if self.parts > 1:
+            raise ValueError("Only one file can be uploaded at a time.")
+        super().on_start()
 
 
 @app.route("/")
@@ -28,67 +43,75 @@ def index():
 @app.route("/upload", methods=["POST"])
 def upload():
     """Handle the upload of a file."""
-    form = request.form
+    # Stream the multipart body straight to disk in fixed-size chunks instead of
+    # letting Werkzeug parse the whole upload through request.files.
+    upload_id = uuid.uuid4().hex
+    tmp_path = os.path.join(UPLOAD_FOLDER, upload_id)
+    file_path = None
+    file_target = SingleFileTarget(tmp_path)
+    ajax_target = ValueTarget()
 
-    # Is the upload using Ajax, or a direct POST by the form?
-    is_ajax = False
-    if form.get("__ajax", None) == "true":
-        is_ajax = True
+    try:
+        parser = StreamingFormDataParser(headers=request.headers)
+        parser.register("file", file_target)
+        parser.register("__ajax", ajax_target)
 
-    # Target folder for these uploads.
-    target = "app/static/uploads"
+        while chunk := request.stream.read(UPLOAD_CHUNK_SIZE):
+            parser.data_received(chunk)
 
-    try:
-        # Retrieve the uploaded file from the request.
-        uploaded_file = request.files['file']
+        # Is the upload using Ajax, or a direct POST by the form?
+        is_ajax = False
+        if ajax_target.value == b"true":
+            is_ajax = True
 
         # Check if a file was uploaded.
-        if uploaded_file.filename != '':
-            filename = uploaded_file.filename
-            file_path = "/".join([target, filename])
-            uploaded_file.save(file_path)
-
-            # If the uploaded file is an audio file, perform transcription.
-            if is_audio(file_path):
-                # Transcription of the audio file
-                transcription = extract_text_from_audio(file_path)
-                os.remove(file_path)
-                if transcription:
-                    print("TRUEE")
-                    # Get the base name of the original file (without extension)
-                    file_name_without_extension = os.path.splitext(filename)[0]
-
-                    # Create the new file name by appending the new extension
-                    new_file_name = f"{file_name_without_extension}.txt"
-                    file_path = "/".join([target, new_file_name])
-                    with open(file_path, 'w') as f:
-                        print("TRUEE")
-                        f.write(transcription)
-                        uploaded_file.save(file_path)
-
-            # Perform speaker analysis and psychological insights on the uploaded file
-            analysis_results = analyse_conversation(file_path)
-            os.remove(file_path)  # Remove the uploaded file after analysis
-            # return render_template('result.html', text=to_render)
-
-        # If the upload was through Ajax, return the analysis results as JSON.
+        filename = file_target.multipart_filename
+        if not filename:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return ajax_response(False, "No file was uploaded.")
+
+        # Never trust the client-supplied name, and keep every upload on its own path.
+        file_path = os.path.join(UPLOAD_FOLDER, f"{upload_id}_{secure_filename(filename)}")
+        os.replace(tmp_path, file_path)
+
+        # Transcription and analysis run in a background job, the client polls for the result.
+        # Imported here so serving the other routes does not load the job dependencies.
+        from tasks import process_upload
+        task = process_upload.delay(file_path, filename)
+
+        # If the upload was through Ajax, return the job id as JSON.
         if is_ajax:
-            return ajax_response(True, analysis_results)
+            return ajax_response(True, task.id), 202
         # If not Ajax, redirect to the upload_complete route to display results.
         else:
-            return redirect(url_for("upload_complete", results=analysis_results))
+            return redirect(url_for("upload_complete", job_id=task.id))
 
     except Exception as e:
+        # Do not leave a partial or unqueued upload behind.
+        for path in (tmp_path, file_path):
+            if path and os.path.exists(path):
+                os.remove(path)
         return ajax_response(False, str(e))
 
 
-@app.route("/result/<results>")
-def upload_complete(results):
-    """Render the result.html template to display the analysis results."""
+@app.route("/result/<job_id>")
+def upload_complete(job_id):
+    """Render the result.html template to display the analysis results of a job."""
+    from celery.result import AsyncResult
+    from tasks import celery_app
+    result = AsyncResult(job_id, app=celery_app)
 
-    # Replace newline characters with HTML line breaks
-    to_render = results.replace("\n", "<br />")
-    return render_template('result.html', text=to_render)
+    # The job is still queued or running, ask the client to come back later.
+    if not result.ready():
+        return render_template('result.html', text="Analysis in progress, refresh this page shortly."), 202
+
+    results = result.get(timeout=0, propagate=False)
+    if not result.successful() or not results:
+        return render_template('result.html', text="The conversation could not be analysed."), 500
+
+    # The template turns newline characters into HTML line breaks
+    return render_template('result.html', text=results)
 
 
 def ajax_response(status, msg):
@@ -100,16 +123,17 @@ def ajax_response(status, msg):
     ))
 
 
-parser = argparse.ArgumentParser(description="Uploadr")
-parser.add_argument(
-    "--port", "-p",
-    type=int,
-    help="Port to listen on",
-    default=2005,
-)
-args = parser.parse_args()
-
+# Local development server only, production runs under gunicorn (see gunicorn.conf.py).
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Uploadr")
+    parser.add_argument(
+        "--port", "-p",
+        type=int,
+        help="Port to listen on",
+        default=2005,
+    )
+    args = parser.parse_args()
+
     flask_options = dict(
         host='0.0.0.0',
         debug=True,
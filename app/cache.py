@@ -0,0 +1,46 @@
+import os
+import zlib
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Redis server shared by the transcript and analysis caches. Leave it unset to keep the
+# caches local to each process.
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Cached text is compressed with the fast zlib level, higher levels cost CPU for little gain.
+COMPRESSION_LEVEL = 3
+
+_redis_client = None
+
+
+def get_redis():
+    """
+    Returns the Redis client shared by the caches, created on first use.
+    Returns: A redis.Redis instance, or None when REDIS_URL is not configured.
+    """
+    global _redis_client
+    if REDIS_URL and _redis_client is None:
+        _redis_client = redis.Redis.from_url(REDIS_URL)
+    return _redis_client
+
+
+def compress(text):
+    """
+    Compresses a text before storing it in a cache.
+    Args:
+    text: The text to compress.
+    Returns: The compressed bytes.
+    """
+    return zlib.compress(text.encode(), COMPRESSION_LEVEL)
+
+
+def decompress(data):
+    """
+    Decompresses a value read from a cache.
+    Args:
+    data: The bytes returned by compress.
+    Returns: The original text.
+    """
+    return zlib.decompress(data).decode()
@@ -1,11 +1,271 @@
 # Import required packages
-import backoff  # for exponential backoff
-import openai
-from openai import OpenAI
+import asyncio
+import hashlib
+import json
+import os
+import re
+import textwrap
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from dotenv import load_dotenv
+from cache import get_redis, compress, decompress
 
 load_dotenv()
 
+# Retrieving the OpenAI API key from environment variables.
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# Completion budget of a single analysis: max_tokens counts against the tokens per minute limit
+# before anything is generated, so it is sized from the conversation, capped at
+# DEFAULT_COMPLETION_TOKENS, instead of always using the configured ceiling. The small floor keeps
+# a few-line conversation from getting a budget too short for any answer.
+DEFAULT_COMPLETION_TOKENS = 512
+MIN_COMPLETION_TOKENS = 64
+COMPLETION_TOKENS_FACTOR = 0.5
+
+# Analyses are cached by (conversation, sentiment logic, model), in memory and in Redis when
+# REDIS_URL is set.
+ANALYSIS_CACHE_SIZE = 1024
+ANALYSIS_CACHE_TTL = 7 * 24 * 60 * 60
+_analysis_cache = OrderedDict()
+
+# Spaces between the end of a sentence and a "[Speaker_N]" block starting on the same line, replaced
+# by a line break so every speaker gets its own line. Mentions inside a sentence and the existing
+# line breaks are left alone.
+_SPEAKER_RE = re.compile(r"(?<=[.!?'\"’])[ \t]+(?=\[speaker_?\d*\])", re.IGNORECASE)
+
+# Prompt templates, built once with the indentation and trailing whitespace stripped.
+SYSTEM_PROMPT = textwrap.dedent("""\
+    You are an advanced AI language model designed to extract expert psychological
+    insights and sentiments of all the speakers in the given conversation flows.
+    Your goal is to distill complex information, identify key sentiment
+    insights about the each speaker according to the {sentiment_logic}, and
+    generate concise and informative description about the insights gathered
+    in the form of {output_format}
+    """)
+
+USER_PROMPT = textwrap.dedent("""\
+    Write expert sentimental or psychological insights of each speaker involved
+    in the following conversational flow:
+    {conversation_text}
+    Consider relevant {reasoning} and nuances in the content.
+    """)
+
+# Single shot prompt
+ASSISTANT_PROMPT = textwrap.dedent("""\
+    [Speaker_2] likes a sport. It seems he cares about his health’.
+    [Speaker_1] pretends to be smart’.
+    """)
+
+# The single shot example goes in the system prompt: sent as the last assistant turn it reads as
+# conversation 1 already answered, and the model tends to carry on from Result 2.
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + textwrap.dedent("""\
+    Answer each numbered conversation separately, starting the insights of
+    conversation i with the line "### Result i", for example:
+    ### Result 1
+    """) + ASSISTANT_PROMPT
+
+BATCH_USER_PROMPT = textwrap.dedent("""\
+    Write expert sentimental or psychological insights of each speaker involved
+    in each of the following conversational flows:
+    {conversations}
+    Consider relevant {reasoning} and nuances in the content.
+    """)
+
+COMBINE_SYSTEM_PROMPT = textwrap.dedent("""\
+    You are an advanced AI language model designed to extract expert psychological
+    insights and sentiments of all the speakers in the given conversation flows.
+    You are given partial insights, each gathered from a consecutive part of the same
+    conversation. Combine them into a single concise and informative description of
+    each speaker in the form of {output_format}
+    """)
+
+COMBINE_USER_PROMPT = textwrap.dedent("""\
+    Combine these partial speaker analyses of one conversation:
+    {partial_analyses}
+    """)
+
+# Upper bound on the conversation text of a single request, longer text is cut to its most recent
+# tokens. Conversations over CHUNK_TOKEN_BUDGET are already split by turns below, so in the realtime
+# path this only cuts a single turn longer than the budget. A batch request gives each of its
+# conversations an INSIGHTS_BATCH_SIZE share of it.
+CONVERSATION_TOKEN_BUDGET = 12000
+
+# Conversations longer than this are split into chunks of speaker turns analysed in parallel,
+# then combined by a final request.
+CHUNK_TOKEN_BUDGET = 3000
+_TURN_RE = re.compile(r"\n\s*\n|\n(?=\[?speaker[ _]?\d+\]?:)", re.IGNORECASE)
+
+# Number of conversations analysed together in a single request by generate_speaker_insights_batch.
+INSIGHTS_BATCH_SIZE = 5
+_BATCH_RESULT_RE = re.compile(r"### Result (\d+)")
+
+# Account limits used to throttle parallel requests before the API starts rejecting them.
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "3500"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "90000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+# The rate limiter lives in each worker process, set this to the total number of worker processes
+# (e.g. the Celery worker concurrency) so together they stay within the account limits.
+OPENAI_WORKER_PROCESSES = int(os.getenv("OPENAI_WORKER_PROCESSES", "1"))
+
+# Seconds between two status checks of a submitted Batch API job.
+BATCH_POLL_INTERVAL = 30
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model_name):
+    # Building an encoding loads its ranks, do it once per model.
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model_name):
+    """
+    Counts the tokens of a text for the given model.
+    Args:
+    text: The text to count.
+    model_name: The OpenAI model the text is sent to.
+    Returns: The number of tokens.
+    """
+    return len(_get_encoding(model_name).encode(text))
+
+
+def truncate_to_token_budget(text, model_name, budget=CONVERSATION_TOKEN_BUDGET):
+    """
+    Keeps the last `budget` tokens of a text, the most recent turns of a conversation.
+    Args:
+    text: The text to truncate.
+    model_name: The OpenAI model the text is sent to.
+    budget: The maximum number of tokens to keep.
+    Returns: The text, truncated when it is longer than the budget.
+    """
+    encoding = _get_encoding(model_name)
+    tokens = encoding.encode(text)
+    if len(tokens) <= budget:
+        return text
+    return encoding.decode(tokens[-budget:])
+
+
+def _split_by_turns(text, model_name, max_tokens=CHUNK_TOKEN_BUDGET):
+    """
+    Splits a conversation on blank lines and speaker labels, then packs consecutive turns into
+    chunks of at most max_tokens tokens. A single turn longer than that is its own chunk.
+    Args:
+    text: The conversation to split.
+    model_name: The OpenAI model the chunks are sent to.
+    max_tokens: The token budget of a chunk.
+    Returns: The list of (chunk, number of tokens) pairs, in conversation order.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for turn in _TURN_RE.split(text):
+        turn = turn.strip()
+        if not turn:
+            continue
+        turn_tokens = count_tokens(turn, model_name)
+        if current and current_tokens + turn_tokens > max_tokens:
+            chunks.append(("\n".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(turn)
+        current_tokens += turn_tokens
+    if current:
+        chunks.append(("\n".join(current), current_tokens))
+    return chunks
+
+
+def estimate_completion_tokens(conversation_text, model_name, tokens=None):
+    """
+    Estimates the completion budget needed to analyse a conversation.
+    Args:
+    conversation_text: The conversation to analyse.
+    model_name: The OpenAI model used for the analysis.
+    tokens: The number of tokens of the conversation when already known, counted otherwise.
+    Returns: The estimated number of completion tokens.
+    """
+    if tokens is None:
+        tokens = count_tokens(conversation_text, model_name)
+    return int(tokens * COMPLETION_TOKENS_FACTOR)
+
+
+# The openai and backoff packages are only imported with the first request.
+@lru_cache(maxsize=None)
+def _get_openai_client(api_key):
+    # One client per API key, so its connection pool is shared by every request.
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+
+def _new_async_openai_client(api_key):
+    # Not cached: the connection pool of an async client is bound to the event loop it was used on,
+    # and every asyncio.run call starts and then closes its own loop.
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=api_key)
+
+
+@lru_cache(maxsize=None)
+def _rate_limit_backoff():
+    # Decorator retrying OpenAI API calls with exponential backoff on rate limit errors.
+    import backoff
+    import openai
+    return backoff.on_exception(backoff.expo, openai.RateLimitError)
+
+
+class RateLimiter:
+    """
+    Token bucket tracking the requests and tokens still available in the current minute,
+    refilled continuously at requests_per_minute / 60 and tokens_per_minute / 60 per second.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = requests_per_minute
+        self.available_tokens = tokens_per_minute
+        self.last_update = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        self.available_requests = min(self.requests_per_minute,
+                                      self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(self.tokens_per_minute,
+                                    self.available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, tokens):
+        """
+        Waits until one request and the given number of tokens are available, then consumes them.
+        Args:
+        tokens: The number of tokens the request is expected to use.
+        """
+        # A request larger than the whole budget would otherwise wait forever.
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            self._refill()
+            if self.available_requests >= 1 and self.available_tokens >= tokens:
+                self.available_requests -= 1
+                self.available_tokens -= tokens
+                return
+            await asyncio.sleep(0.1)
+
+
+_rate_limiter = RateLimiter(OPENAI_REQUESTS_PER_MINUTE / OPENAI_WORKER_PROCESSES,
+                            OPENAI_TOKENS_PER_MINUTE / OPENAI_WORKER_PROCESSES)
+
+
+def format_speaker_lines(full_text):
+    """
+    Splits the generated text on the basis of each speaker, one speaker block per line.
+    Args:
+    full_text: The text generated by the model.
+    Returns: The formatted text.
+    """
+    return _SPEAKER_RE.sub("\n", full_text)
+
 
 # Define your LLMWrapper class within this file, with the necessary methods.
 class LLMWrapper:
@@ -14,53 +274,148 @@ class LLMWrapper:
         self.api_key = api_key
         self.model_name = config['model_name']
         self.max_tokens = config['max_tokens']
+        # "realtime" uses the chat completions endpoint directly, "batch" the Batch API.
+        self.mode = config.get('mode', 'realtime')
 
     # Function to handle OpenAI API calls with rate limit backoff
-    @backoff.on_exception(backoff.expo, openai.RateLimitError)
-    def prompt_completion(self, messages):
+    def prompt_completion(self, messages, max_tokens=None):
         """
         Prompt completion is a helper function that wraps the OpenAI API call to
         complete a prompt. It handles rate limiting and retries on errors.
         Args:
         prompt: The prompt to complete.
+        max_tokens: The completion budget, defaults to the configured max_tokens.
         Returns: The OpenAI API response.
         """
 
         try:
             # Logic to generate a response to a prompt by interacting with the OpenAI API.
-            client = OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
+            client = _get_openai_client(self.api_key)
+            response = _rate_limit_backoff()(client.chat.completions.create)(
                 model=self.model_name,
                 messages=messages,
-                max_tokens=self.max_tokens
+                max_tokens=max_tokens or self.max_tokens
             )
 
-            # Return the generated response.
-            full_text = response.choices[0].message.content
+            # Return the generated response, one speaker per line.
+            return format_speaker_lines(response.choices[0].message.content)
 
-            # Split text on the basis of each speaker of the generated text
-            sentences = full_text.split("r'speaker\d*")
-            # print("sentences", sentences)
+        except Exception as e:
+            print(f"Exception in OpenAI completion task: {str(e)}")
+            return None
+
+    async def _create_completion_async(self, client, messages, max_tokens):
+        async def create():
+            return await client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                max_tokens=max_tokens
+            )
 
-            # # Split the generated text into sentences
-            # if len(sentences) > 1:
-            #     first_sentence = sentences[0].strip()
-            #     if not first_sentence[0].isupper() or not first_sentence[-1].isalnum():
-            #         full_text = full_text[len(first_sentence):].strip()
-            #
-            #     last_sentence = sentences[-1].strip()
-            #     if not last_sentence or not last_sentence[-1].isalnum():  # Add check for empty string
-            #         full_text = full_text[:len(full_text) - len(last_sentence)].strip()
+        # Reactive fallback when the proactive throttling still hits the rate limit
+        return await _rate_limit_backoff()(create)()
 
-            # Additional cleanup
-            # full_text = full_text.strip(".”")
-            f = '\n'.join(sentences)
-            return f
+    async def prompt_completion_async(self, messages, max_tokens=None, client=None):
+        """
+        Asynchronous counterpart of prompt_completion, throttled by the shared rate limiter
+        so concurrent requests stay within the account's requests and tokens per minute.
+        Args:
+        messages: The chat messages to complete.
+        max_tokens: The completion budget, defaults to the configured max_tokens.
+        client: The AsyncOpenAI client of the running event loop, a new one is opened and closed
+        for this request when omitted.
+        Returns: The generated text, or None on error.
+        """
+        try:
+            # The request counts its prompt plus its whole completion budget against the limit.
+            max_tokens = max_tokens or self.max_tokens
+            prompt_tokens = sum(count_tokens(message["content"], self.model_name) for message in messages)
+            await _rate_limiter.acquire(prompt_tokens + max_tokens)
+
+            if client is None:
+                async with _new_async_openai_client(self.api_key) as client:
+                    response = await self._create_completion_async(client, messages, max_tokens)
+            else:
+                response = await self._create_completion_async(client, messages, max_tokens)
+            return format_speaker_lines(response.choices[0].message.content)
 
         except Exception as e:
             print(f"Exception in OpenAI completion task: {str(e)}")
             return None
 
+    async def prompt_completions_parallel(self, messages_list, concurrency=OPENAI_MAX_CONCURRENCY,
+                                          max_tokens=None):
+        """
+        Completes several prompts concurrently, with at most `concurrency` requests in flight.
+        Args:
+        messages_list: A list of chat messages, one entry per prompt.
+        concurrency: The maximum number of requests in flight.
+        max_tokens: The completion budget of each request, defaults to the configured max_tokens.
+        Returns: The generated texts in the same order as messages_list, None where a request failed.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        # One client for the requests of this event loop, closed with it.
+        async with _new_async_openai_client(self.api_key) as client:
+            async def complete(messages):
+                async with semaphore:
+                    return await self.prompt_completion_async(messages, max_tokens, client)
+
+            return await asyncio.gather(*(complete(messages) for messages in messages_list))
+
+    def prompt_completion_batch(self, messages_by_id, poll_interval=BATCH_POLL_INTERVAL, max_tokens_by_id=None):
+        """
+        Completes several prompts through the OpenAI Batch API, which has its own, larger quotas
+        and a lower price per token, at the cost of results arriving within 24 hours.
+        Args:
+        messages_by_id: A dict mapping a custom id to the chat messages to complete.
+        poll_interval: Seconds to wait between two status checks of the batch.
+        max_tokens_by_id: A dict mapping a custom id to its completion budget, the configured
+        max_tokens is used for the ids it does not contain.
+        Returns: A dict mapping each custom id to the generated text, None where it failed.
+        """
+        results = dict.fromkeys(messages_by_id)
+        max_tokens_by_id = max_tokens_by_id or {}
+        try:
+            client = _get_openai_client(self.api_key)
+
+            # One chat completion request per line, mirroring the realtime payload.
+            batch_requests = "\n".join(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": self.model_name, "messages": messages,
+                         "max_tokens": max_tokens_by_id.get(custom_id, self.max_tokens)},
+            }) for custom_id, messages in messages_by_id.items())
+
+            batch_input = client.files.create(file=("batch.jsonl", batch_requests.encode()), purpose="batch")
+            batch = client.batches.create(
+                input_file_id=batch_input.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(poll_interval)
+                batch = client.batches.retrieve(batch.id)
+
+            if batch.status != "completed":
+                print(f"OpenAI batch {batch.id} ended with status {batch.status}")
+                return results
+
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                record = json.loads(line)
+                response = record.get("response")
+                if response and response["status_code"] == 200:
+                    results[record["custom_id"]] = format_speaker_lines(
+                        response["body"]["choices"][0]["message"]["content"]
+                    )
+            return results
+
+        except Exception as e:
+            print(f"Exception in OpenAI batch task: {str(e)}")
+            return results
+
     def extract_conversation_text(self, file_path):
         """
         Extracts the text from a conversation.
@@ -76,8 +431,8 @@ class LLMWrapper:
             return content
 
         except Exception as e:
-            print(f"Forbidden URL Exception, Error downloading and parsing article from {file}: {str(e)}")
-            return None, None
+            print(f"Error reading the conversation from {file_path}: {str(e)}")
+            return None
 
 
 class SmartConversationAnalysis:
@@ -97,16 +452,151 @@ class SmartConversationAnalysis:
             # Fetch and process the content from the URL.
             conversation_text = self.load_text_content(text_file)
 
+            return self.deep_analytics_text(conversation_text, sentiment_logic)
+
+        except Exception as e:
+            print(f"Exception in summarization process: {str(e)}")
+            return None
+
+    def deep_analytics_text(self, conversation_text, sentiment_logic):
+        """
+        Generates the speaker analysis of a conversation already in memory (e.g. a transcript),
+        using the given sentiment logic.
+        Args:
+        conversation_text (str): the chat to be analyzed.
+        sentiment_logic (str): Summarization logic to be used.
+        Returns: formatted_output (str): Formatted output of each speaker analysis.
+        """
+        if not conversation_text:
+            print("Nothing to analyse, the conversation is empty.")
+            return None
+
+        try:
+            # Reuse a previous analysis of the same conversation when there is one.
+            key = self.analysis_cache_key(conversation_text, sentiment_logic)
+            summary = self.get_cached_analysis(key)
+            if summary is not None:
+                return summary
+
             # Make separate API calls for each part of the article
             print("\nGenerating Summary...\n")
             summary = self.generate_speaker_insights(conversation_text, sentiment_logic)
 
+            if summary:
+                self.cache_analysis(key, summary)
             return summary
 
         except Exception as e:
             print(f"Exception in summarization process: {str(e)}")
             return None
 
+    def analysis_cache_key(self, conversation_text, sentiment_logic):
+        """
+        Builds the cache key of an analysis.
+        Args:
+        conversation_text: The conversation to analyse.
+        sentiment_logic: A dict indicating the reasoning and output format in the prompt.
+        Returns: The SHA-256 hex digest identifying the analysis.
+        """
+        key_source = conversation_text + json.dumps(sentiment_logic, sort_keys=True) + self.llm_wrapper.model_name
+        return hashlib.sha256(key_source.encode()).hexdigest()
+
+    def get_cached_analysis(self, key):
+        """
+        Looks up a cached analysis, first in memory then in Redis.
+        Args:
+        key: The cache key of the analysis.
+        Returns: The cached analysis, or None on a cache miss or when Redis is unavailable.
+        """
+        if key in _analysis_cache:
+            _analysis_cache.move_to_end(key)
+            return _analysis_cache[key]
+
+        try:
+            redis_client = get_redis()
+            if redis_client is not None:
+                cached = redis_client.get(f"gpt:{key}")
+                if cached:
+                    summary = decompress(cached)
+                    self.cache_analysis(key, summary, persist=False)
+                    return summary
+        except Exception as e:
+            print(f"Ignoring the cached analysis {key}: {e}")
+        return None
+
+    def cache_analysis(self, key, summary, persist=True):
+        """
+        Stores an analysis in the in-memory cache and, when persist is set, in Redis.
+        Args:
+        key: The cache key of the analysis.
+        summary: The analysis to cache.
+        persist: Whether to also store the analysis in Redis.
+        """
+        _analysis_cache[key] = summary
+        _analysis_cache.move_to_end(key)
+        if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+
+        if not persist:
+            return
+        try:
+            redis_client = get_redis()
+            if redis_client is not None:
+                redis_client.setex(f"gpt:{key}", ANALYSIS_CACHE_TTL, compress(summary))
+        except Exception as e:
+            print(f"Could not cache the analysis {key}: {e}")
+
+    def deep_analytics_batch(self, text_files, sentiment_logic):
+        """
+        Generates the speaker analysis of several text files. In "batch" mode the uncached
+        conversations are submitted to the OpenAI Batch API, otherwise they are analysed
+        through generate_speaker_insights_batch.
+        Args:
+        text_files (list): paths of the chats to be analyzed.
+        sentiment_logic (str): Summarization logic to be used.
+        Returns: A dict mapping each path to its speaker analysis, None where it failed.
+        """
+        results = {}
+        pending = {}
+        for text_file in text_files:
+            conversation_text = self.load_text_content(text_file)
+            if not conversation_text:
+                results[text_file] = None
+                continue
+
+            key = self.analysis_cache_key(conversation_text, sentiment_logic)
+            summary = self.get_cached_analysis(key)
+            if summary is not None:
+                results[text_file] = summary
+            else:
+                pending[text_file] = (key, conversation_text)
+
+        if not pending:
+            return results
+
+        print(f"\nGenerating {len(pending)} Summaries...\n")
+        if self.llm_wrapper.mode == "batch":
+            tokens = {text_file: count_tokens(conversation_text, self.llm_wrapper.model_name)
+                      for text_file, (_, conversation_text) in pending.items()}
+            summaries = self.llm_wrapper.prompt_completion_batch({
+                text_file: self.build_insights_messages(conversation_text, sentiment_logic, tokens[text_file])
+                for text_file, (_, conversation_text) in pending.items()
+            }, max_tokens_by_id={
+                text_file: self.completion_budget(conversation_text, tokens[text_file])
+                for text_file, (_, conversation_text) in pending.items()
+            })
+        else:
+            texts = [conversation_text for _, conversation_text in pending.values()]
+            summaries = dict(zip(pending, self.generate_speaker_insights_batch(texts, sentiment_logic)))
+
+        for text_file, (key, _) in pending.items():
+            summary = summaries.get(text_file)
+            if summary:
+                self.cache_analysis(key, summary)
+            results[text_file] = summary
+
+        return results
+
     def load_text_content(self, file):
         """
         Loads the conversation from a file uploaded.
@@ -119,84 +609,201 @@ class SmartConversationAnalysis:
 
         return conversation_flow
 
-    def generate_speaker_insights(self, conversation_text, sentiment_logic):
+    def build_insights_messages(self, conversation_text, sentiment_logic, tokens=None):
+        """
+        Builds the chat messages asking for the speaker analysis of a conversation.
+        Args:
+        conversation_text: The conversation to analyse.
+        sentiment_logic: A dict indicating the reasoning and output format in the prompt.
+        tokens: The number of tokens of the conversation when already known, the text is only
+        encoded again when it may exceed CONVERSATION_TOKEN_BUDGET.
+        Returns: The list of system, user and assistant messages.
+        """
+        if tokens is None or tokens > CONVERSATION_TOKEN_BUDGET:
+            conversation_text = truncate_to_token_budget(conversation_text, self.llm_wrapper.model_name)
+
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT.format(
+                sentiment_logic=sentiment_logic, output_format=sentiment_logic['output_format'])},
+            {"role": "user", "content": USER_PROMPT.format(
+                conversation_text=conversation_text, reasoning=sentiment_logic['reasoning'])},
+            {"role": "assistant", "content": ASSISTANT_PROMPT}
+        ]
+
+        return messages
+
+    def completion_budget(self, conversation_text, tokens=None):
         """
-        Generate speaker analysis from the chat
+        Estimates the completion budget of the analysis of a conversation.
+        Args:
+        conversation_text: The conversation to analyse.
+        tokens: The number of tokens of the conversation when already known, counted otherwise.
+        Returns: The number of completion tokens, at most DEFAULT_COMPLETION_TOKENS and never above
+        the configured max_tokens.
+        """
+        estimate = estimate_completion_tokens(conversation_text, self.llm_wrapper.model_name, tokens)
+        return min(DEFAULT_COMPLETION_TOKENS, max(MIN_COMPLETION_TOKENS, estimate), self.llm_wrapper.max_tokens)
+
+    def generate_speaker_insights(self, conversation_text, sentiment_logic, max_tokens=None):
+        """
+        Generate speaker analysis from the chat. Long chats are split by speaker turns, the parts
+        are analysed in parallel and the partial analyses combined by a final request.
         Args:
         conversation_text: A list of responses in the conversation.
         sentiment_logic: A dict indicating the reasoning and output format in the prompt.
+        max_tokens: The completion budget, estimated from the conversation length when omitted,
+        never above the configured max_tokens.
         Returns: A string containing the speaker analysis of each speaker in the conversation.
         """
         try:
             # Logic to generate a psychological and sentiment insights of speakers from the conversation history.
-            summaries = []
-
-            # Generate system and user prompts
-            # print(f"\nSystem: Give the sentimental insights of the following chat:\n{conversation_text}\n")
-            system_prompt = f"""
-                          You are an advanced AI language model designed to extract expert psychological
-                          insights and sentiments of all the speakers in the given conversation flows.
-                          Your goal is to distill complex information, identify key sentiment
-                          insights about the each speaker according to the {sentiment_logic}, and 
-                          generate concise and informative description about the insights gathered 
-                          in the form of {sentiment_logic['output_format']}
-                          """
-
-            user_prompt = f"""
-                        Write expert sentimental or psychological insights of each speaker involved 
-                        in the following conversational flow: \n{conversation_text}\n
-                        Consider relevant {sentiment_logic['reasoning']} and nuances in the content.
-                        """
-            # Single shot prompt
-            assistant_prompt = f"""
-                        [Speaker_2] likes a sport. It seems he cares about his health’.
-                        [Speaker_1] pretends to be smart’.
-                        """
+            chunks = _split_by_turns(conversation_text, self.llm_wrapper.model_name)
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-                {"role": "assistant", "content": assistant_prompt}
-            ]
+            if len(chunks) <= 1:
+                # The split already counted the tokens of the whole conversation, reuse them.
+                tokens = chunks[0][1] if chunks else 0
+                if max_tokens is None:
+                    max_tokens = self.completion_budget(conversation_text, tokens)
+                max_tokens = min(max_tokens, self.llm_wrapper.max_tokens)
 
-            # Call the LLM wrapper to generate a response to the prompt.
-            summary = self.llm_wrapper.prompt_completion(messages)
-            summaries.append(summary)
+                messages = self.build_insights_messages(conversation_text, sentiment_logic, tokens)
 
-            # Combine the summaries of all chunks
-            combined_summary = " ".join(summaries)
+                # Call the LLM wrapper to generate a response to the prompt.
+                return self.llm_wrapper.prompt_completion(messages, max_tokens)
 
-            return combined_summary
+            # Map: analyse every chunk in parallel.
+            chunk_budget = max(self.completion_budget(chunk, tokens) for chunk, tokens in chunks)
+            messages_list = [self.build_insights_messages(chunk, sentiment_logic, tokens) for chunk, tokens in chunks]
+            summaries = asyncio.run(
+                self.llm_wrapper.prompt_completions_parallel(messages_list, max_tokens=chunk_budget)
+            )
+            # A partial analysis would be cached as if it were complete, fail the whole conversation.
+            if not all(summaries):
+                return None
+
+            # Reduce: combine the summaries of all chunks
+            partial_analyses = "\n\n".join(
+                f"## Part {i}\n{summary}" for i, summary in enumerate(summaries, start=1)
+            )
+            messages = [
+                {"role": "system", "content": COMBINE_SYSTEM_PROMPT.format(
+                    output_format=sentiment_logic['output_format'])},
+                {"role": "user", "content": COMBINE_USER_PROMPT.format(partial_analyses=partial_analyses)}
+            ]
+            if max_tokens is None:
+                max_tokens = self.completion_budget(partial_analyses)
+            return self.llm_wrapper.prompt_completion(messages, min(max_tokens, self.llm_wrapper.max_tokens))
 
         # Handle exceptions if the LLM wrapper encounters an error.
         except Exception as e:
             print(f"Generating summary error occurred. {e}")
             return None
 
+    def generate_speaker_insights_batch(self, conversation_texts, sentiment_logic):
+        """
+        Generate speaker analysis of several chats, INSIGHTS_BATCH_SIZE conversations per request.
+        The requests of the different batches are sent in parallel.
+        Args:
+        conversation_texts: A list of conversations to analyse.
+        sentiment_logic: A dict indicating the reasoning and output format in the prompt.
+        Returns: A list with the speaker analysis of each conversation, None where it failed.
+        """
+        try:
+            batches = [conversation_texts[start:start + INSIGHTS_BATCH_SIZE]
+                       for start in range(0, len(conversation_texts), INSIGHTS_BATCH_SIZE)]
+
+            system_prompt = BATCH_SYSTEM_PROMPT.format(
+                sentiment_logic=sentiment_logic, output_format=sentiment_logic['output_format'])
+            # The conversations of a request share the token budget.
+            budget = CONVERSATION_TOKEN_BUDGET // INSIGHTS_BATCH_SIZE
+
+            messages_list = []
+            request_budget = 0
+            for batch in batches:
+                # A request answers every conversation of its batch, within the configured ceiling.
+                # Each conversation is encoded once, to size the request and to truncate it if needed.
+                tokens = [count_tokens(text, self.llm_wrapper.model_name) for text in batch]
+                request_budget = max(request_budget, min(
+                    sum(self.completion_budget(text, count) for text, count in zip(batch, tokens)),
+                    self.llm_wrapper.max_tokens))
+
+                # Number the conversations so the model can answer each of them in its own block.
+                conversations = "\n\n".join(
+                    f"## Conversation {i}\n"
+                    f"{truncate_to_token_budget(text, self.llm_wrapper.model_name, budget) if count > budget else text}"
+                    for i, (text, count) in enumerate(zip(batch, tokens), start=1)
+                )
+                user_prompt = BATCH_USER_PROMPT.format(
+                    conversations=conversations, reasoning=sentiment_logic['reasoning'])
+                messages_list.append([
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ])
+
+            responses = asyncio.run(
+                self.llm_wrapper.prompt_completions_parallel(messages_list, max_tokens=request_budget)
+            )
+
+            results = []
+            for batch, response in zip(batches, responses):
+                if response is None:
+                    results.extend([None] * len(batch))
+                    continue
+
+                # Match every result block to its conversation by number, missing answers stay None.
+                parts = _BATCH_RESULT_RE.split(response)
+                summaries = [None] * len(batch)
+                for index, summary in zip(parts[1::2], parts[2::2]):
+                    index = int(index)
+                    if 1 <= index <= len(batch) and summaries[index - 1] is None:
+                        summaries[index - 1] = summary.strip()
+                results.extend(summaries)
+
+            return results
+
+        # Handle exceptions if the LLM wrapper encounters an error.
+        except Exception as e:
+            print(f"Generating batch summary error occurred. {e}")
+            return [None] * len(conversation_texts)
+
+
+# Configuration for the LLMWrapper, such as the model name and the max_tokens ceiling.
+# Set "mode" to "batch" to send bulk jobs (deep_analytics_batch) through the OpenAI Batch API.
+OPENAI_CONFIG = {"model_name": "gpt-3.5-turbo", "max_tokens": 2000, "mode": "realtime"}
+
+# The logic for summarization may include parameters like reasoning or output format, or it could be blank.
+SENTIMENT_LOGIC = {
+    "reasoning": "Extract key points relevant to sentiment analysis.",
+    "output_format": "Speaker name followed by the results."
+}
+
+
+def _get_analyser():
+    # Instantiate the chat analyser with the API key and configuration.
+    return SmartConversationAnalysis(OPENAI_API_KEY, OPENAI_CONFIG)
+
 
 # Main function to demonstrate usage.
 # Instantiate the SmartConversationAnalysis class.
 def analyse_conversation(text_file):
     # The text file of the conversation for analysis.
+    analyser = _get_analyser()
 
-    # Retrieving the OpenAI API key from environment variables.
-    # openai_api_key = os.getenv("OPENAI_API_KEY")
-    openai_api_key = 'sk-proj-s3yNbCkllfEghhpxkcURT3BlbkFJ5LuscMSPnEnlqVbOmN8X'
+    # Generate the summary.
+    analytics = analyser.deep_analytics(text_file, SENTIMENT_LOGIC)
 
-    # Configuration for the LLMWrapper, such as the model name and token limits.
-    openai_config = {"model_name": "gpt-3.5-turbo", "max_tokens": 2000}
+    # Print the summary.
+    print("\nDeep analytics generated.\n")
+
+    return analytics
 
-    # Instantiate the chat analyser with the API key and configuration.
-    analyser = SmartConversationAnalysis(openai_api_key, openai_config)
 
-    # The logic for summarization may include parameters like reasoning or output format, or it could be blank.
-    sentiment_logic = {
-        "reasoning": "Extract key points relevant to sentiment analysis.",
-        "output_format": "Speaker name followed by the results."
-    }
+def analyse_conversation_text(text):
+    # The conversation text for analysis, e.g. a transcript that never needs to touch the disk.
+    analyser = _get_analyser()
 
     # Generate the summary.
-    analytics = analyser.deep_analytics(text_file, sentiment_logic)
+    analytics = analyser.deep_analytics_text(text, SENTIMENT_LOGIC)
 
     # Print the summary.
     print("\nDeep analytics generated.\n")
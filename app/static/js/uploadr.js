@@ -5,7 +5,7 @@
 // Constants
 var MAX_UPLOAD_FILE_SIZE = 1024*1024; // 1 MB
 var UPLOAD_URL = "/upload";
-var NEXT_URL   = "/files/";
+var NEXT_URL   = "/result/";
 
 // List of pending files to handle when the Upload button is finally clicked.
 var PENDING_FILES  = [];
@@ -91,7 +91,7 @@ function doUpload() {
                 return;
             }
             else {
-                // Ok! Get the UUID.
+                // Ok! Get the job id.
                 var uuid = data.msg;
                 window.location = NEXT_URL + uuid;
             }
@@ -0,0 +1,87 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+from celery import Celery
+import os
+from urllib.parse import quote
+
+# Broker and result backend for the background jobs, configurable through the environment.
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+
+# URL under which Deepgram can download the uploads folder (e.g. http://<host>/static/uploads).
+# When set, audio is transcribed from that URL instead of being uploaded by the worker.
+AUDIO_BASE_URL = os.getenv("AUDIO_BASE_URL")
+
+celery_app = Celery('app', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+celery_app.conf.update(
+    # Transcription and analysis are both network bound, allow them ten minutes in total.
+    task_time_limit=600,
+    # Only acknowledge a job once it has finished so a crashed worker does not lose it.
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+    # Analyses are plain text and compress well in the result backend.
+    result_compression="zlib",
+    # Results are looked up by job id from /result/<job_id>, keep them for an hour.
+    result_expires=3600,
+)
+
+
+# Leading bytes of the audio containers accepted for transcription.
+AUDIO_SIGNATURES = {
+    b"RIFF": "wav",
+    b"ID3": "mp3",
+    b"\xff\xfb": "mp3",
+    b"\xff\xf3": "mp3",
+    b"\xff\xf2": "mp3",
+    b"OggS": "ogg",
+    b"fLaC": "flac",
+}
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".ogg", ".flac", ".opus"}
+
+
+# Function to check if the file is an audio file based on its header, then the extension of its original name
+def is_audio(file_path, filename):
+    with open(file_path, 'rb') as f:
+        header = f.read(16)
+
+    if any(header.startswith(signature) for signature in AUDIO_SIGNATURES):
+        return True
+    # MP4/M4A files start with the size of their "ftyp" box.
+    if header[4:8] == b"ftyp":
+        return True
+    return os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS
+
+
+@celery_app.task(rate_limit="10/m")
+def process_upload(file_path, filename):
+    """
+    Transcribes (for audio files) and analyses an uploaded conversation in the background.
+    Args:
+    file_path: The path of the uploaded file, unique to this job and readable by the worker.
+    filename: The original name of the uploaded file.
+    Returns: The speaker analysis of the conversation.
+    """
+    # Deepgram and OpenAI are only loaded by the workers, never by the web process.
+    from transcribe_audio_deepgram import extract_text_from_audio  # Import function for audio transcription
+    # Import functions for speaker analysis
+    from speaker_analysis_gpt import analyse_conversation, analyse_conversation_text
+
+    try:
+        # If the uploaded file is an audio file, perform transcription.
+        if is_audio(file_path, filename):
+            # Transcription of the audio file
+            audio_url = None
+            if AUDIO_BASE_URL:
+                audio_url = f"{AUDIO_BASE_URL.rstrip('/')}/{quote(os.path.basename(file_path))}"
+            transcription = extract_text_from_audio(file_path, audio_url)
+            if not transcription:
+                return None
+
+            # Analyse the transcript directly, it is never written to disk.
+            return analyse_conversation_text(transcription)
+
+        # Perform speaker analysis and psychological insights on the uploaded file
+        return analyse_conversation(file_path)
+
+    finally:
+        os.remove(file_path)  # Remove the uploaded file after analysis
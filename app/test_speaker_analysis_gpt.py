@@ -0,0 +1,53 @@
+import speaker_analysis_gpt
+from speaker_analysis_gpt import SmartConversationAnalysis, SENTIMENT_LOGIC, format_speaker_lines
+
+
+def _analyser_answering(monkeypatch, response):
+    # Skip the tokenizer and answer every batch request with the given response.
+    monkeypatch.setattr(speaker_analysis_gpt, "truncate_to_token_budget", lambda text, *args: text)
+    monkeypatch.setattr(speaker_analysis_gpt, "count_tokens", lambda text, model_name: len(text.split()))
+    analyser = SmartConversationAnalysis("", {"model_name": "gpt-3.5-turbo", "max_tokens": 2000})
+
+    async def prompt_completions_parallel(messages_list, **kwargs):
+        analyser.sent_messages = messages_list
+        return [response] * len(messages_list)
+
+    monkeypatch.setattr(analyser.llm_wrapper, "prompt_completions_parallel", prompt_completions_parallel)
+    return analyser
+
+
+def test_batch_results_skipped_answer(monkeypatch):
+    analyser = _analyser_answering(monkeypatch, "### Result 1\nA-analysis\n### Result 3\nC-analysis")
+    results = analyser.generate_speaker_insights_batch(["A", "B", "C"], SENTIMENT_LOGIC)
+    assert results == ["A-analysis", None, "C-analysis"]
+
+
+def test_batch_results_reordered_answers(monkeypatch):
+    analyser = _analyser_answering(monkeypatch, "Sure.\n### Result 2\nB-analysis\n### Result 1\nA-analysis")
+    results = analyser.generate_speaker_insights_batch(["A", "B"], SENTIMENT_LOGIC)
+    assert results == ["A-analysis", "B-analysis"]
+
+
+def test_batch_request_ends_with_the_conversations(monkeypatch):
+    analyser = _analyser_answering(monkeypatch, "### Result 1\nA-analysis")
+    analyser.generate_speaker_insights_batch(["A"], SENTIMENT_LOGIC)
+    messages = analyser.sent_messages[0]
+    assert [message["role"] for message in messages] == ["system", "user"]
+    assert "### Result 1" in messages[0]["content"]
+
+
+def test_completion_budget_is_capped(monkeypatch):
+    analyser = _analyser_answering(monkeypatch, "")
+    assert analyser.completion_budget("word " * 10) == speaker_analysis_gpt.MIN_COMPLETION_TOKENS
+    assert analyser.completion_budget("word " * 600) == 300
+    assert analyser.completion_budget("word " * 5000) == speaker_analysis_gpt.DEFAULT_COMPLETION_TOKENS
+
+
+def test_format_speaker_lines_splits_speaker_blocks():
+    text = "[Speaker_1] is calm. [Speaker_2] is upset."
+    assert format_speaker_lines(text) == "[Speaker_1] is calm.\n[Speaker_2] is upset."
+
+
+def test_format_speaker_lines_keeps_inline_mentions_and_paragraphs():
+    text = "[Speaker_1] agrees with [Speaker_2] on it.\n\n[Speaker_2] is upset."
+    assert format_speaker_lines(text) == text
@@ -1,37 +1,127 @@
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
+import gzip
+import hashlib
+import json
+import os
+import tempfile
 import httpx
-
-from deepgram import (
-    DeepgramClient,
-    DeepgramClientOptions,
-    PrerecordedOptions,
-    FileSource,
-)
+from functools import lru_cache
+from cache import get_redis, compress, decompress, COMPRESSION_LEVEL
 
 load_dotenv()
 
+# Size of the chunks read from the audio file, keeps memory flat whatever the upload size.
+CHUNK_SIZE = 8 * 1024 * 1024
 
-def extract_text_from_audio(audio_file):
-    AUDIO_FILE = audio_file
+# Transcripts are cached by audio content, compressed, on disk or in Redis when REDIS_URL is set.
+DEEPGRAM_CACHE_DIR = os.getenv("DEEPGRAM_CACHE_DIR", "/tmp/dg-cache")
+DEEPGRAM_CACHE_TTL = 24 * 60 * 60
+
+
+@lru_cache(maxsize=None)
+def _get_deepgram_client():
+    # Create a Deepgram client using the API key in the environment variables, once for all uploads.
+    # The SDK is heavy to import, so it is only loaded with the first transcription.
+    from deepgram import DeepgramClient, DeepgramClientOptions
+
+    config: DeepgramClientOptions = DeepgramClientOptions(
+        verbose=logging.WARNING
+    )
+    return DeepgramClient("", config)
+
+
+def hash_file_chunked(file):
+    """
+    Computes the SHA-256 hash of an open binary file without reading it in memory at once.
+    Args:
+    file: The file object, opened in binary mode.
+    Returns: The hex digest of the file content; the file is rewound to its start.
+    """
+    hasher = hashlib.sha256()
+    while chunk := file.read(CHUNK_SIZE):
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def load_cached_response(file_id):
+    """
+    Looks up a Deepgram response cached for an audio file.
+    Args:
+    file_id: The content hash of the audio file.
+    Returns: The cached response as a dict, or None on a cache miss or when the cache is unreadable.
+    """
     try:
+        redis_client = get_redis()
+        if redis_client is not None:
+            cached = redis_client.get(f"dg:{file_id}")
+            return json.loads(decompress(cached)) if cached else None
 
-        # STEP 1 Create a Deepgram client using the API key in the environment variables
-        config: DeepgramClientOptions = DeepgramClientOptions(
-            # api_key="6aaf95e6249b75dab257e16d0082222d06e6bc77",
-            verbose=logging.SPAM
-        )
-        deepgram: DeepgramClient = DeepgramClient("", config)
+        cache_path = os.path.join(DEEPGRAM_CACHE_DIR, f"{file_id}.json.gz")
+        if os.path.exists(cache_path):
+            with gzip.open(cache_path, 'rt') as f:
+                return json.load(f)
+        return None
+
+    except Exception as e:
+        print(f"Ignoring the cached transcript of {file_id}: {e}")
+        return None
 
-        # STEP 2 Call the transcribe_file method on the prerecorded class
+
+def store_cached_response(file_id, response_json):
+    """
+    Caches a Deepgram response for an audio file.
+    Args:
+    file_id: The content hash of the audio file.
+    response_json: The Deepgram response serialized as JSON.
+    """
+    try:
+        redis_client = get_redis()
+        if redis_client is not None:
+            redis_client.setex(f"dg:{file_id}", DEEPGRAM_CACHE_TTL, compress(response_json))
+            return
+
+        # Write to a temporary file first so readers never see a partially written entry.
+        os.makedirs(DEEPGRAM_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=DEEPGRAM_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', compresslevel=COMPRESSION_LEVEL) as f:
+                f.write(response_json)
+            os.replace(tmp_path, os.path.join(DEEPGRAM_CACHE_DIR, f"{file_id}.json.gz"))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    except Exception as e:
+        print(f"Could not cache the transcript of {file_id}: {e}")
+
+
+def extract_text_from_audio(audio_file, audio_url=None):
+    """
+    Transcribes an audio file with Deepgram.
+    Args:
+    audio_file: The path of the audio file.
+    audio_url: Optional URL where Deepgram can fetch the same file, in which case the audio
+    is not uploaded from this process.
+    Returns: The diarized transcript of the audio.
+    """
+    AUDIO_FILE = audio_file
+    try:
+
+        # Skip Deepgram entirely when the same audio has already been transcribed
         with open(AUDIO_FILE, "rb") as file:
-            buffer_data = file.read()
+            file_id = hash_file_chunked(file)[:16]
+        cached_response = load_cached_response(file_id)
+        if cached_response is not None:
+            return cached_response["results"]["channels"][0]["alternatives"][0]["paragraphs"]["transcript"]
 
-        payload: FileSource = {
-            "buffer": buffer_data,
-        }
+        from deepgram import PrerecordedOptions, FileSource, UrlSource
+        deepgram = _get_deepgram_client()
 
+        # Call the transcribe_url method on the prerecorded class when the audio is reachable by
+        # URL, otherwise transcribe_file, streaming the open file instead of reading it in memory
         options: PrerecordedOptions = PrerecordedOptions(
             model="nova",
             smart_format=True,
@@ -41,13 +131,28 @@ def extract_text_from_audio(audio_file):
         )
 
         before = datetime.now()
-        response = deepgram.listen.prerecorded.v("1").transcribe_file(
-            payload, options, timeout=httpx.Timeout(300.0, connect=10.0)
-        )
+        if audio_url:
+            # Deepgram downloads the audio itself, nothing is sent from this process
+            source: UrlSource = {
+                "url": audio_url,
+            }
+            response = deepgram.listen.prerecorded.v("1").transcribe_url(
+                source, options, timeout=httpx.Timeout(300.0, connect=10.0)
+            )
+        else:
+            with open(AUDIO_FILE, "rb") as file:
+                payload: FileSource = {
+                    "stream": file,
+                }
+                response = deepgram.listen.prerecorded.v("1").transcribe_file(
+                    payload, options, timeout=httpx.Timeout(300.0, connect=10.0)
+                )
         after = datetime.now()
         difference = after - before
         print(f"time: {difference.seconds}")
 
+        store_cached_response(file_id, response.to_json())
+
         return response["results"]["channels"][0]["alternatives"][0]["paragraphs"]["transcript"]
 
     except Exception as e:
@@ -0,0 +1,15 @@
+# Gunicorn configuration for the Flask application, run from the repository root with:
+#   gunicorn app:app
+import os
+
+# The application modules import each other by their bare names.
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '2005')}"
+
+# Requests mostly wait on the network, gevent workers multiplex many of them per process.
+# The gevent worker monkey-patches the standard library itself before loading the app.
+worker_class = "gevent"
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+worker_connections = 200
+timeout = 600